@@ -1,10 +1,27 @@
 import os
+import atexit
+import tempfile
+import sys
 import glob
 import re
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba is optional; without it the merge falls back to plain NumPy.
+    njit = None
+
+try:
+    import png
+except ImportError:
+    # pypng is optional; without it the output PNG is encoded by Pillow in memory.
+    png = None
+
 # --- FIX FOR LARGE MAPS ---
 Image.MAX_IMAGE_PIXELS = None
 
@@ -13,13 +30,45 @@ INPUT_FOLDER = '.'
 LCF_FILENAME = 'color_scale.lcf'
 OUTPUT_NAME = 'composite_coverage'
 LEGEND_FILENAME = 'composite_legend.png'
-UNDEFINED_PATH_LOSS = 9999.0 
+
+# Path loss is stored as uint16 in 0.1 dB steps; 0xFFFF marks "no signal".
+LOSS_SCALE = 10
+UNDEFINED_PATH_LOSS = 0xFFFF
+
+# Rows merged per pass in the NumPy path, so each stripe's source, loss and
+# mask arrays stay cache-resident across the compare/copy sequence.
+MERGE_BLOCK_ROWS = 256
+
+# Worker processes decoding layers (PNG read + RGB -> path loss) ahead of the merge.
+# With 1, decoding runs on a single background thread instead.
+WORKERS = os.cpu_count() or 1
+
+# Decoded layers queued ahead of the merge. This, not WORKERS, bounds memory:
+# at most PREFETCH_LAYERS + 1 decoded layers are held at once, and at most
+# that many workers are started, however many cores the machine has.
+PREFETCH_LAYERS = 2
+
+# Canvases with more pixels than this keep their master buffers in
+# memory-mapped scratch files in INPUT_FOLDER (unlinked at once on POSIX), so the OS
+# pages them to disk instead of the run failing with an out-of-memory error.
+MEMMAP_MIN_PIXELS = 100_000_000
+
+def pack_rgb(rgb):
+    return (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+
+def pack_rgba_u32(rgb):
+    # Opaque RGBA pixels as uint32, in the byte order of master_rgba.view(np.uint32)
+    r, g, b = (rgb[..., i].astype(np.uint32) for i in range(3))
+    if sys.byteorder == 'little':
+        return r | (g << 8) | (b << 16) | np.uint32(0xFF000000)
+    return (r << 24) | (g << 16) | (b << 8) | np.uint32(0xFF)
 
 class ColorScale:
     def __init__(self, lcf_path):
         self.color_map = {}
         self.entries = []
         self.load_lcf(lcf_path)
+        self.build_lookup()
 
     def load_lcf(self, path):
         if not os.path.exists(path):
@@ -41,6 +90,45 @@ class ColorScale:
         self.entries.sort(key=lambda x: x[0])
         print(f"Loaded {len(self.color_map)} colors for legend.")
 
+    def build_lookup(self):
+        # Dense 24-bit LUT indexed by packed (R<<16)|(G<<8)|B, so a whole image
+        # is decoded with a single gather instead of one scan per color.
+        self.lut = np.full(1 << 24, UNDEFINED_PATH_LOSS, dtype=np.uint16)
+        for (r, g, b), db in self.color_map.items():
+            self.lut[(r << 16) | (g << 8) | b] = min(max(round(db * LOSS_SCALE), 0), UNDEFINED_PATH_LOSS - 1)
+
+    def decode_loss(self, rgb):
+        return self.lut[pack_rgb(rgb)]
+
+    def palette_lookup(self, img):
+        # For palette ('P') images, as SPLAT! usually writes: returns the 256
+        # palette colors and their path loss, so pixels can be decoded straight
+        # from their 1-byte indices without expanding the image to RGB.
+        pal = np.zeros((256, 3), dtype=np.uint8)
+        colors = np.array(img.getpalette(), dtype=np.uint8).reshape(-1, 3)[:256]
+        pal[:len(colors)] = colors
+        return pal, self.decode_loss(pal)
+
+# Fused per-layer merge: compare and masked store in a single pass over
+# the layer instead of one full-array pass per NumPy operation.
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def merge_layer(temp_loss, src_chunk, loss_slice, rgba_slice):
+        h, w = loss_slice.shape
+        for i in prange(h):
+            for j in range(w):
+                loss = temp_loss[i, j]
+                if loss != UNDEFINED_PATH_LOSS and loss < loss_slice[i, j]:
+                    loss_slice[i, j] = loss
+                    rgba_slice[i, j, 0] = src_chunk[i, j, 0]
+                    rgba_slice[i, j, 1] = src_chunk[i, j, 1]
+                    rgba_slice[i, j, 2] = src_chunk[i, j, 2]
+                    rgba_slice[i, j, 3] = 255
+else:
+    merge_layer = None
+
+BBOX_FIELDS = ('north', 'south', 'east', 'west')
+
 class MapLayer:
     def __init__(self, kml_path):
         self.kml_path = kml_path
@@ -59,20 +147,139 @@ class MapLayer:
 
     def parse_kml(self):
         try:
-            tree = ET.parse(self.kml_path)
-            root = tree.getroot()
-            for elem in tree.iter():
-                if '}' in elem.tag:
-                    elem.tag = elem.tag.split('}', 1)[1]
-            bbox = root.find('.//LatLonBox')
+            # Stream the KML and stop at the first <LatLonBox> rather than
+            # building the whole tree. Tag names are qualified once with every
+            # namespace the document declares, default or prefixed (KML 2.1
+            # and 2.2 use different ones), so each element is matched with a
+            # plain lookup.
+            box_tags = {'LatLonBox'}
+            field_tags = {f: f for f in BBOX_FIELDS}
+            bbox = None
+            for event, item in ET.iterparse(self.kml_path, events=('start-ns', 'end')):
+                if event == 'start-ns':
+                    _, uri = item
+                    box_tags.add(f'{{{uri}}}LatLonBox')
+                    field_tags.update({f'{{{uri}}}{f}': f for f in BBOX_FIELDS})
+                    continue
+                if item.tag in box_tags:
+                    bbox = {field_tags[child.tag]: child.text for child in item if child.tag in field_tags}
+                    break
+                if item.tag not in field_tags:
+                    item.clear()
             if bbox is None: raise ValueError("No <LatLonBox>")
-            self.north = float(bbox.findtext('north'))
-            self.south = float(bbox.findtext('south'))
-            self.east = float(bbox.findtext('east'))
-            self.west = float(bbox.findtext('west'))
+            self.north = float(bbox.get('north'))
+            self.south = float(bbox.get('south'))
+            self.east = float(bbox.get('east'))
+            self.west = float(bbox.get('west'))
         except Exception as e:
             raise ValueError(f"XML Error {self.kml_path}: {e}")
 
+def remove_scratch_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def new_canvas(shape, dtype, fill=0):
+    if shape[0] * shape[1] <= MEMMAP_MIN_PIXELS:
+        return np.full(shape, fill, dtype=dtype)
+    # The system temp dir is often RAM-backed, so the scratch file goes next to the maps
+    fd, path = tempfile.mkstemp(prefix='.composite_', suffix='.dat', dir=INPUT_FOLDER)
+    os.close(fd)
+    canvas = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+    # On POSIX the open mapping outlives its directory entry, so the file is
+    # unlinked at once and nothing is left behind even if the process is
+    # killed. Windows refuses to delete a mapped file; there it goes at exit.
+    try:
+        os.remove(path)
+    except OSError:
+        atexit.register(remove_scratch_file, path)
+    if fill: canvas.fill(fill)
+    return canvas
+
+# Set in each worker process by init_worker()
+worker_color_scale = None
+
+def init_worker(color_scale):
+    global worker_color_scale
+    worker_color_scale = color_scale
+
+def decode_layer(layer, canvas):
+    # Runs in a worker: reads one layer and converts it to path loss, clipped
+    # to the canvas. Returns None if the layer falls outside the canvas.
+    global_north, global_west, ppd_lat, ppd_lon, master_h, master_w = canvas
+    with Image.open(layer.png_path) as img:
+        src_w, src_h = img.size
+
+        y_start = int((global_north - layer.north) * ppd_lat)
+        x_start = int((layer.west - global_west) * ppd_lon)
+        curr_h = min(y_start + src_h, master_h) - y_start
+        curr_w = min(x_start + src_w, master_w) - x_start
+        if curr_h <= 0 or curr_w <= 0: return None
+
+        if img.mode == 'P':
+            # The 1-byte indices go back with the palette and are expanded to
+            # RGB by the merge, so a third of the pixel data crosses the pipe
+            pal, pal_loss = worker_color_scale.palette_lookup(img)
+            idx_chunk = np.asarray(img)[:curr_h, :curr_w]
+            return y_start, x_start, idx_chunk, pal, pal_loss[idx_chunk]
+
+        src_chunk = np.asarray(img.convert('RGB'))[:curr_h, :curr_w]
+    return y_start, x_start, src_chunk, None, worker_color_scale.decode_loss(src_chunk)
+
+def make_decode_pool(color_scale):
+    workers = min(WORKERS, PREFETCH_LAYERS + 1)
+    if workers > 1:
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(color_scale,))
+    # One thread still overlaps the next layer's decode with the current
+    # merge (Pillow and NumPy release the GIL) without pickling results.
+    return ThreadPoolExecutor(max_workers=1, initializer=init_worker, initargs=(color_scale,))
+
+def prefetch_layers(pool, layers, canvas):
+    # Yields (layer, future) in layer order while keeping at most PREFETCH_LAYERS
+    # layers decoding ahead, which bounds the decoded data held in memory.
+    pending = deque()
+    for layer in layers:
+        pending.append((layer, pool.submit(decode_layer, layer, canvas)))
+        if len(pending) > PREFETCH_LAYERS:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+def save_composite_png(master_rgba, color_scale, path):
+    colors = list(color_scale.color_map)
+    if len(colors) > 255:
+        Image.fromarray(master_rgba, 'RGBA').save(path)
+        return
+
+    # Every painted pixel holds one of the LCF colors, so the map is written
+    # as an 8-bit palette PNG (index 0 = transparent) instead of full RGBA.
+    index_lut = np.zeros(1 << 24, dtype=np.uint8)
+    for i, (r, g, b) in enumerate(colors, start=1):
+        index_lut[(r << 16) | (g << 8) | b] = i
+
+    master_h, master_w, _ = master_rgba.shape
+    def index_blocks():
+        for y0 in range(0, master_h, MERGE_BLOCK_ROWS):
+            rows = master_rgba[y0:y0 + MERGE_BLOCK_ROWS]
+            yield y0, np.where(rows[..., 3] != 0, index_lut[pack_rgb(rows)], np.uint8(0))
+
+    if png is not None:
+        # Stream rows to the encoder so the canvas is never held twice in memory
+        palette = [(0, 0, 0, 0)] + [(r, g, b, 255) for r, g, b in colors]
+        with open(path, 'wb') as f:
+            png.Writer(master_w, master_h, palette=palette, bitdepth=8).write(
+                f, (row for _, block in index_blocks() for row in block))
+        return
+
+    master_index = np.zeros((master_h, master_w), dtype=np.uint8)
+    for y0, block in index_blocks():
+        master_index[y0:y0 + len(block)] = block
+
+    out = Image.fromarray(master_index)
+    out.putpalette([0, 0, 0] + [c for rgb in colors for c in rgb])
+    out.save(path, transparency=0)
+
 def create_legend_image(color_scale):
     print("Generating legend image...")
     
@@ -113,11 +320,20 @@ def create_legend_image(color_scale):
     total_height = (num_entries * entry_height) + (padding * 2)
 
     # 3. Create Image
-    img = Image.new('RGBA', (total_width, total_height), (0, 0, 0, 0))
+    # Color boxes (with their 1px black outline) are painted as NumPy row
+    # bands in one array; Pillow is only used for the text.
+    legend_arr = np.zeros((total_height, total_width, 4), dtype=np.uint8)
+    boxes = legend_arr[:, total_width - box_width:]
+    for i, (_, r, g, b) in enumerate(color_scale.entries):
+        y0 = padding + i * entry_height
+        boxes[y0:y0 + box_height + 1] = (r, g, b, 255)
+        boxes[[y0, y0 + box_height]] = (0, 0, 0, 255)
+        boxes[y0:y0 + box_height + 1, 0] = (0, 0, 0, 255)
+    img = Image.fromarray(legend_arr)
     draw = ImageDraw.Draw(img)
 
     current_y = padding
-    for db, r, g, b in color_scale.entries:
+    for db, _, _, _ in color_scale.entries:
         label = f"{db:.0f} dB"
         
         # Calculate X position to align text to the right of the text-area
@@ -129,20 +345,9 @@ def create_legend_image(color_scale):
         # It ends at: total_width - box_width - padding
         text_x = total_width - box_width - padding - text_w
         
-        # Draw Black Outline
-        for ox in [-1, 1]:
-            for oy in [-1, 1]:
-                draw.text((text_x + ox, current_y + oy), label, font=font, fill=(0,0,0,255))
-        
-        # Draw White Text
-        draw.text((text_x, current_y), label, fill=(255, 255, 255, 255), font=font)
-        
-        # Draw Color Box (Far Right)
-        draw.rectangle(
-            [total_width - box_width, current_y, total_width, current_y + box_height],
-            fill=(r, g, b, 255),
-            outline=(0, 0, 0, 255)
-        )
+        # Draw White Text with a Black Outline
+        draw.text((text_x, current_y), label, fill=(255, 255, 255, 255), font=font,
+                  stroke_width=1, stroke_fill=(0, 0, 0, 255))
         current_y += entry_height
 
     img.save(LEGEND_FILENAME)
@@ -170,10 +375,11 @@ def create_composite_map():
 
     if not layers: return
 
-    global_north = max(l.north for l in layers)
-    global_south = min(l.south for l in layers)
-    global_east = max(l.east for l in layers)
-    global_west = min(l.west for l in layers)
+    bboxes = np.array([(l.north, l.south, l.east, l.west) for l in layers])
+    global_north = float(bboxes[:, 0].max())
+    global_south = float(bboxes[:, 1].min())
+    global_east = float(bboxes[:, 2].max())
+    global_west = float(bboxes[:, 3].min())
 
     ref_layer = layers[0]
     with Image.open(ref_layer.png_path) as img:
@@ -186,49 +392,55 @@ def create_composite_map():
 
     print(f"Canvas: {master_w}x{master_h} pixels")
     
-    master_loss = np.full((master_h, master_w), UNDEFINED_PATH_LOSS, dtype=np.float32)
-    master_rgba = np.zeros((master_h, master_w, 4), dtype=np.uint8)
+    master_loss = new_canvas((master_h, master_w), np.uint16, UNDEFINED_PATH_LOSS)
+    master_rgba = new_canvas((master_h, master_w, 4), np.uint8)
+    # Same memory seen as one uint32 per pixel, for single-store masked writes
+    master_u32 = master_rgba.view(np.uint32)[..., 0]
 
-    for layer in layers:
-        print(f"Merging {os.path.basename(layer.png_path)}...")
-        try:
-            with Image.open(layer.png_path) as img:
-                img = img.convert('RGB')
-                src_arr = np.array(img)
-                src_h, src_w, _ = src_arr.shape
-
-                y_start = int((global_north - layer.north) * ppd_lat)
-                x_start = int((layer.west - global_west) * ppd_lon)
-                y_end = min(y_start + src_h, master_h)
-                x_end = min(x_start + src_w, master_w)
-                curr_h, curr_w = y_end - y_start, x_end - x_start
-                if curr_h <= 0 or curr_w <= 0: continue
-
-                src_chunk = src_arr[:curr_h, :curr_w]
-                temp_loss = np.full((curr_h, curr_w), UNDEFINED_PATH_LOSS, dtype=np.float32)
-                
-                for (r,g,b), db in color_scale.color_map.items():
-                    mask = (src_chunk[:,:,0]==r) & (src_chunk[:,:,1]==g) & (src_chunk[:,:,2]==b)
-                    temp_loss[mask] = db
-
-                master_slice = master_loss[y_start:y_end, x_start:x_end]
-                update_mask = (temp_loss < master_slice) & (temp_loss != UNDEFINED_PATH_LOSS)
-
-                master_loss[y_start:y_end, x_start:x_end] = np.where(update_mask, temp_loss, master_slice)
-                
-                target_region = master_rgba[y_start:y_end, x_start:x_end]
-                src_chunk_rgba = np.zeros((curr_h, curr_w, 4), dtype=np.uint8)
-                src_chunk_rgba[..., :3] = src_chunk
-                src_chunk_rgba[..., 3] = 255
-                
-                target_region[update_mask] = src_chunk_rgba[update_mask]
-                master_rgba[y_start:y_end, x_start:x_end] = target_region
+    # Largest footprints are merged first: they settle most pixels early,
+    # so later layers find little or nothing to update.
+    merge_order = sorted(layers, key=lambda l: -(l.north - l.south) * (l.east - l.west))
 
-        except Exception as e:
-            print(f"Error: {e}")
+    # Layers are decoded in parallel by the pool; the merge into the master
+    # buffers stays serial and in merge order.
+    canvas = (global_north, global_west, ppd_lat, ppd_lon, master_h, master_w)
+    with make_decode_pool(color_scale) as pool:
+        for layer, future in prefetch_layers(pool, merge_order, canvas):
+            print(f"Merging {os.path.basename(layer.png_path)}...")
+            try:
+                decoded = future.result()
+                if decoded is None: continue
+                y_start, x_start, src_chunk, pal, temp_loss = decoded
+                if pal is not None: src_chunk = pal[src_chunk]
+                curr_h, curr_w = temp_loss.shape
+                y_end, x_end = y_start + curr_h, x_start + curr_w
+
+                if merge_layer is not None:
+                    merge_layer(temp_loss, src_chunk,
+                                master_loss[y_start:y_end, x_start:x_end],
+                                master_rgba[y_start:y_end, x_start:x_end])
+                    continue
+
+                for y0 in range(0, curr_h, MERGE_BLOCK_ROWS):
+                    y1 = min(y0 + MERGE_BLOCK_ROWS, curr_h)
+                    src_block = src_chunk[y0:y1]
+                    loss_block = temp_loss[y0:y1]
+
+                    master_slice = master_loss[y_start + y0:y_start + y1, x_start:x_end]
+                    update_mask = (loss_block < master_slice) & (loss_block != UNDEFINED_PATH_LOSS)
+                    if not update_mask.any(): continue
+
+                    # Masked in-place writes: no np.where temporaries, no write-back
+                    np.copyto(master_slice, loss_block, where=update_mask)
+                    
+                    np.copyto(master_u32[y_start + y0:y_start + y1, x_start:x_end],
+                              pack_rgba_u32(src_block), where=update_mask)
+
+            except Exception as e:
+                print(f"Error: {e}")
 
     print("Saving composite map...")
-    Image.fromarray(master_rgba, 'RGBA').save(f"{OUTPUT_NAME}.png")
+    save_composite_png(master_rgba, color_scale, f"{OUTPUT_NAME}.png")
 
     create_legend_image(color_scale)
 
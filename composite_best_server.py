@@ -1,10 +1,26 @@
 import os
+import atexit
+import tempfile
 import glob
 import re
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba is optional; without it the merge falls back to plain NumPy.
+    njit = None
+
+try:
+    import png
+except ImportError:
+    # pypng is optional; without it the output PNG is encoded by Pillow in memory.
+    png = None
+
 # --- FIX FOR LARGE MAPS ---
 Image.MAX_IMAGE_PIXELS = None
 
@@ -19,7 +35,33 @@ LEGEND_FILENAME = 'composite_server_legend.png'
 # The pixel will remain transparent.
 VALID_THRESHOLD_DB = 150.0 
 
-UNDEFINED_PATH_LOSS = 9999.0 
+# Path loss is stored as uint16 in 0.1 dB steps; 0xFFFF marks "no signal".
+LOSS_SCALE = 10
+UNDEFINED_PATH_LOSS = 0xFFFF
+VALID_THRESHOLD = int(round(VALID_THRESHOLD_DB * LOSS_SCALE))
+
+# Rows merged per pass in the NumPy path, so each stripe's source, loss and
+# mask arrays stay cache-resident across the compare/copy sequence.
+MERGE_BLOCK_ROWS = 256
+
+# Worker processes decoding layers (PNG read + RGB -> path loss) ahead of the merge.
+# With 1, decoding runs on a single background thread instead.
+WORKERS = os.cpu_count() or 1
+
+# Decoded layers queued ahead of the merge. This, not WORKERS, bounds memory:
+# at most PREFETCH_LAYERS + 1 decoded layers are held at once, and at most
+# that many workers are started, however many cores the machine has.
+PREFETCH_LAYERS = 2
+
+# Canvases with more pixels than this keep their master buffers in
+# memory-mapped scratch files in INPUT_FOLDER (unlinked at once on POSIX), so the OS
+# pages them to disk instead of the run failing with an out-of-memory error.
+MEMMAP_MIN_PIXELS = 100_000_000
+
+# Cache each layer's decoded path loss next to its image as <name>.loss.npz.
+# A cache file is reused only while the mtime and size of both the image and
+# the LCF exactly match the ones it was built from.
+CACHE_LOSS_ARRAYS = True
 
 # PALETTE ASSIGNMENT
 SERVER_PALETTE = [
@@ -37,8 +79,10 @@ SERVER_PALETTE = [
 
 class ColorScale:
     def __init__(self, lcf_path):
+        self.path = lcf_path
         self.color_map = {}
         self.load_lcf(lcf_path)
+        self.build_lookup()
 
     def load_lcf(self, path):
         if not os.path.exists(path):
@@ -55,6 +99,43 @@ class ColorScale:
                         self.color_map[(r, g, b)] = db
                     except ValueError: continue
 
+    def build_lookup(self):
+        # Dense 24-bit LUT indexed by packed (R<<16)|(G<<8)|B, so a whole image
+        # is decoded with a single gather instead of one scan per color.
+        self.lut = np.full(1 << 24, UNDEFINED_PATH_LOSS, dtype=np.uint16)
+        for (r, g, b), db in self.color_map.items():
+            self.lut[(r << 16) | (g << 8) | b] = min(max(round(db * LOSS_SCALE), 0), UNDEFINED_PATH_LOSS - 1)
+
+    def decode_loss(self, rgb):
+        packed = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+        return self.lut[packed]
+
+    def palette_lookup(self, img):
+        # For palette ('P') images, as SPLAT! usually writes: returns the 256
+        # palette colors and their path loss, so pixels can be decoded straight
+        # from their 1-byte indices without expanding the image to RGB.
+        pal = np.zeros((256, 3), dtype=np.uint8)
+        colors = np.array(img.getpalette(), dtype=np.uint8).reshape(-1, 3)[:256]
+        pal[:len(colors)] = colors
+        return pal, self.decode_loss(pal)
+
+# Fused per-layer merge: compare and masked store in a single pass over
+# the layer instead of one full-array pass per NumPy operation.
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def merge_layer(temp_loss, loss_slice, owner_slice, owner_id, threshold):
+        h, w = loss_slice.shape
+        for i in prange(h):
+            for j in range(w):
+                loss = temp_loss[i, j]
+                if loss < loss_slice[i, j] and loss <= threshold:
+                    loss_slice[i, j] = loss
+                    owner_slice[i, j] = owner_id
+else:
+    merge_layer = None
+
+BBOX_FIELDS = ('north', 'south', 'east', 'west')
+
 class MapLayer:
     def __init__(self, kml_path, index, color):
         self.kml_path = kml_path
@@ -74,22 +155,137 @@ class MapLayer:
         self.west = 0.0
         self.parse_kml()
 
+    def get_loss_array(self, color_scale):
+        cache_path = os.path.splitext(self.png_path)[0] + '.loss.npz'
+        if CACHE_LOSS_ARRAYS:
+            # The cache holds the path loss ('loss') and the mtime and size of
+            # the image and the LCF it was built from ('key'). It is used only on
+            # an exact match, so a replacement file with an older timestamp is
+            # not mistaken for the cached one.
+            try:
+                png_stat, lcf_stat = os.stat(self.png_path), os.stat(color_scale.path)
+                source_key = np.array([png_stat.st_mtime_ns, png_stat.st_size,
+                                       lcf_stat.st_mtime_ns, lcf_stat.st_size], dtype=np.int64)
+            except OSError:
+                source_key = None
+            try:
+                with np.load(cache_path) as cached:
+                    if source_key is not None and np.array_equal(cached['key'], source_key):
+                        return cached['loss']
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with Image.open(self.png_path) as img:
+            if img.mode == 'P':
+                _, pal_loss = color_scale.palette_lookup(img)
+                loss_arr = pal_loss[np.asarray(img)]
+            else:
+                loss_arr = color_scale.decode_loss(np.asarray(img.convert('RGB')))
+
+        if CACHE_LOSS_ARRAYS and source_key is not None:
+            # Write then rename so an interrupted run never leaves a partial cache
+            tmp_path = cache_path + '.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, key=source_key, loss=loss_arr)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                print(f"Could not write {cache_path}: {e}")
+        return loss_arr
+
     def parse_kml(self):
         try:
-            tree = ET.parse(self.kml_path)
-            root = tree.getroot()
-            for elem in tree.iter():
-                if '}' in elem.tag:
-                    elem.tag = elem.tag.split('}', 1)[1]
-            bbox = root.find('.//LatLonBox')
+            # Stream the KML and stop at the first <LatLonBox> rather than
+            # building the whole tree. Tag names are qualified once with every
+            # namespace the document declares, default or prefixed (KML 2.1
+            # and 2.2 use different ones), so each element is matched with a
+            # plain lookup.
+            box_tags = {'LatLonBox'}
+            field_tags = {f: f for f in BBOX_FIELDS}
+            bbox = None
+            for event, item in ET.iterparse(self.kml_path, events=('start-ns', 'end')):
+                if event == 'start-ns':
+                    _, uri = item
+                    box_tags.add(f'{{{uri}}}LatLonBox')
+                    field_tags.update({f'{{{uri}}}{f}': f for f in BBOX_FIELDS})
+                    continue
+                if item.tag in box_tags:
+                    bbox = {field_tags[child.tag]: child.text for child in item if child.tag in field_tags}
+                    break
+                if item.tag not in field_tags:
+                    item.clear()
             if bbox is None: raise ValueError("No <LatLonBox>")
-            self.north = float(bbox.findtext('north'))
-            self.south = float(bbox.findtext('south'))
-            self.east = float(bbox.findtext('east'))
-            self.west = float(bbox.findtext('west'))
+            self.north = float(bbox.get('north'))
+            self.south = float(bbox.get('south'))
+            self.east = float(bbox.get('east'))
+            self.west = float(bbox.get('west'))
         except Exception as e:
             raise ValueError(f"XML Error {self.kml_path}: {e}")
 
+def remove_scratch_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def new_canvas(shape, dtype, fill=0):
+    if shape[0] * shape[1] <= MEMMAP_MIN_PIXELS:
+        return np.full(shape, fill, dtype=dtype)
+    # The system temp dir is often RAM-backed, so the scratch file goes next to the maps
+    fd, path = tempfile.mkstemp(prefix='.composite_', suffix='.dat', dir=INPUT_FOLDER)
+    os.close(fd)
+    canvas = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+    # On POSIX the open mapping outlives its directory entry, so the file is
+    # unlinked at once and nothing is left behind even if the process is
+    # killed. Windows refuses to delete a mapped file; there it goes at exit.
+    try:
+        os.remove(path)
+    except OSError:
+        atexit.register(remove_scratch_file, path)
+    if fill: canvas.fill(fill)
+    return canvas
+
+# Set in each worker process by init_worker()
+worker_color_scale = None
+
+def init_worker(color_scale):
+    global worker_color_scale
+    worker_color_scale = color_scale
+
+def decode_layer(layer, canvas):
+    # Runs in a worker: gets one layer's path loss, clipped to the canvas.
+    # Returns None if the layer falls outside the canvas.
+    global_north, global_west, ppd_lat, ppd_lon, master_h, master_w = canvas
+    loss_arr = layer.get_loss_array(worker_color_scale)
+    src_h, src_w = loss_arr.shape
+
+    y_start = int((global_north - layer.north) * ppd_lat)
+    x_start = int((layer.west - global_west) * ppd_lon)
+    curr_h = min(y_start + src_h, master_h) - y_start
+    curr_w = min(x_start + src_w, master_w) - x_start
+    if curr_h <= 0 or curr_w <= 0: return None
+
+    return y_start, x_start, loss_arr[:curr_h, :curr_w]
+
+def make_decode_pool(color_scale):
+    workers = min(WORKERS, PREFETCH_LAYERS + 1)
+    if workers > 1:
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(color_scale,))
+    # One thread still overlaps the next layer's decode with the current
+    # merge (Pillow and NumPy release the GIL) without pickling results.
+    return ThreadPoolExecutor(max_workers=1, initializer=init_worker, initargs=(color_scale,))
+
+def prefetch_layers(pool, layers, canvas):
+    # Yields (layer, future) in layer order while keeping at most PREFETCH_LAYERS
+    # layers decoding ahead, which bounds the decoded data held in memory.
+    pending = deque()
+    for layer in layers:
+        pending.append((layer, pool.submit(decode_layer, layer, canvas)))
+        if len(pending) > PREFETCH_LAYERS:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
 def create_legend_image(layers):
     print("Generating Best Server legend...")
     entry_height = 30       
@@ -117,7 +313,17 @@ def create_legend_image(layers):
     total_width = int(left_margin + max_text_width + padding + box_width)
     total_height = (len(layers) * entry_height) + (padding * 2)
 
-    img = Image.new('RGBA', (total_width, total_height), (0, 0, 0, 0))
+    # Color boxes (with their 1px black outline) are painted as NumPy row
+    # bands in one array; Pillow is only used for the text.
+    legend_arr = np.zeros((total_height, total_width, 4), dtype=np.uint8)
+    boxes = legend_arr[:, total_width - box_width:]
+    for i, layer in enumerate(layers):
+        r, g, b = layer.display_color
+        y0 = padding + i * entry_height
+        boxes[y0:y0 + box_height + 1] = (r, g, b, 255)
+        boxes[[y0, y0 + box_height]] = (0, 0, 0, 255)
+        boxes[y0:y0 + box_height + 1, 0] = (0, 0, 0, 255)
+    img = Image.fromarray(legend_arr)
     draw = ImageDraw.Draw(img)
 
     current_y = padding
@@ -127,17 +333,8 @@ def create_legend_image(layers):
         text_w = text_bbox[2] - text_bbox[0]
         text_x = total_width - box_width - padding - text_w
         
-        for ox in [-1, 1]:
-            for oy in [-1, 1]:
-                draw.text((text_x + ox, current_y + oy), label, font=font, fill=(0,0,0,255))
-        
-        draw.text((text_x, current_y), label, fill=(255, 255, 255, 255), font=font)
-        r, g, b = layer.display_color
-        draw.rectangle(
-            [total_width - box_width, current_y, total_width, current_y + box_height],
-            fill=(r, g, b, 255),
-            outline=(0, 0, 0, 255)
-        )
+        draw.text((text_x, current_y), label, fill=(255, 255, 255, 255), font=font,
+                  stroke_width=1, stroke_fill=(0, 0, 0, 255))
         current_y += entry_height
 
     img.save(LEGEND_FILENAME)
@@ -168,10 +365,11 @@ def create_composite_map():
 
     if not layers: return
 
-    global_north = max(l.north for l in layers)
-    global_south = min(l.south for l in layers)
-    global_east = max(l.east for l in layers)
-    global_west = min(l.west for l in layers)
+    bboxes = np.array([(l.north, l.south, l.east, l.west) for l in layers])
+    global_north = float(bboxes[:, 0].max())
+    global_south = float(bboxes[:, 1].min())
+    global_east = float(bboxes[:, 2].max())
+    global_west = float(bboxes[:, 3].min())
 
     ref_layer = layers[0]
     with Image.open(ref_layer.png_path) as img:
@@ -184,62 +382,68 @@ def create_composite_map():
 
     print(f"Canvas: {master_w}x{master_h} pixels")
     
-    master_loss = np.full((master_h, master_w), UNDEFINED_PATH_LOSS, dtype=np.float32)
+    master_loss = new_canvas((master_h, master_w), np.uint16, UNDEFINED_PATH_LOSS)
     # Master ID 0 = Transparent/No Coverage
-    master_owner_id = np.zeros((master_h, master_w), dtype=np.uint8)
-
-    for layer in layers:
-        print(f"Merging {layer.base_name}...")
-        try:
-            with Image.open(layer.png_path) as img:
-                img = img.convert('RGB')
-                src_arr = np.array(img)
-                src_h, src_w, _ = src_arr.shape
-
-                y_start = int((global_north - layer.north) * ppd_lat)
-                x_start = int((layer.west - global_west) * ppd_lon)
-                y_end = min(y_start + src_h, master_h)
-                x_end = min(x_start + src_w, master_w)
-                curr_h, curr_w = y_end - y_start, x_end - x_start
-                if curr_h <= 0 or curr_w <= 0: continue
-
-                src_chunk = src_arr[:curr_h, :curr_w]
-                temp_loss = np.full((curr_h, curr_w), UNDEFINED_PATH_LOSS, dtype=np.float32)
-                
-                for (r,g,b), db in color_scale.color_map.items():
-                    mask = (src_chunk[:,:,0]==r) & (src_chunk[:,:,1]==g) & (src_chunk[:,:,2]==b)
-                    temp_loss[mask] = db
-
-                master_slice = master_loss[y_start:y_end, x_start:x_end]
-                
-                # --- UPDATE LOGIC WITH CUTOFF ---
-                # 1. New signal must be stronger than existing master (lower loss)
-                # 2. New signal must be strong enough to matter (<= VALID_THRESHOLD_DB)
-                better_mask = (temp_loss < master_slice) & (temp_loss <= VALID_THRESHOLD_DB)
-
-                master_loss[y_start:y_end, x_start:x_end] = np.where(better_mask, temp_loss, master_slice)
-                
-                # Update owner ID
-                owner_slice = master_owner_id[y_start:y_end, x_start:x_end]
-                master_owner_id[y_start:y_end, x_start:x_end] = np.where(better_mask, layer.index, owner_slice)
-
-        except Exception as e:
-            print(f"Error: {e}")
+    master_owner_id = new_canvas((master_h, master_w), np.uint8)
+
+    # Largest footprints are merged first: they settle most pixels early,
+    # so later layers find little or nothing to update.
+    merge_order = sorted(layers, key=lambda l: -(l.north - l.south) * (l.east - l.west))
+
+    # Layers are decoded in parallel by the pool; the merge into the master
+    # buffers stays serial and in merge order.
+    canvas = (global_north, global_west, ppd_lat, ppd_lon, master_h, master_w)
+    with make_decode_pool(color_scale) as pool:
+        for layer, future in prefetch_layers(pool, merge_order, canvas):
+            print(f"Merging {layer.base_name}...")
+            try:
+                decoded = future.result()
+                if decoded is None: continue
+                y_start, x_start, temp_loss = decoded
+                curr_h, curr_w = temp_loss.shape
+                y_end, x_end = y_start + curr_h, x_start + curr_w
+
+                if merge_layer is not None:
+                    merge_layer(temp_loss,
+                                master_loss[y_start:y_end, x_start:x_end],
+                                master_owner_id[y_start:y_end, x_start:x_end],
+                                layer.index, VALID_THRESHOLD)
+                    continue
+
+                for y0 in range(0, curr_h, MERGE_BLOCK_ROWS):
+                    y1 = min(y0 + MERGE_BLOCK_ROWS, curr_h)
+                    loss_block = temp_loss[y0:y1]
+
+                    master_slice = master_loss[y_start + y0:y_start + y1, x_start:x_end]
+                    
+                    # --- UPDATE LOGIC WITH CUTOFF ---
+                    # 1. New signal must be stronger than existing master (lower loss)
+                    # 2. New signal must be strong enough to matter (<= VALID_THRESHOLD_DB)
+                    better_mask = (loss_block < master_slice) & (loss_block <= VALID_THRESHOLD)
+                    if not better_mask.any(): continue
+
+                    # Masked in-place writes: no np.where temporaries, no write-back
+                    np.copyto(master_slice, loss_block, where=better_mask)
+                    
+                    # Update owner ID
+                    owner_slice = master_owner_id[y_start + y0:y_start + y1, x_start:x_end]
+                    np.copyto(owner_slice, np.uint8(layer.index), where=better_mask)
+
+            except Exception as e:
+                print(f"Error: {e}")
 
     print("Painting Best Server map...")
-    # Initialize FULLY TRANSPARENT (0,0,0,0)
-    final_rgba = np.zeros((master_h, master_w, 4), dtype=np.uint8)
-    
-    for layer in layers:
-        # Only paint where we have a winner (ID > 0)
-        mask = (master_owner_id == layer.index)
-        
-        final_rgba[mask, 0] = layer.display_color[0]
-        final_rgba[mask, 1] = layer.display_color[1]
-        final_rgba[mask, 2] = layer.display_color[2]
-        final_rgba[mask, 3] = 255 # Opaque
-
-    Image.fromarray(final_rgba, 'RGBA').save(f"{OUTPUT_NAME}.png")
+    # The owner IDs already are palette indices (0 = no winner), so they are
+    # saved as an 8-bit palette PNG with index 0 FULLY TRANSPARENT.
+    if png is not None:
+        # Stream rows to the encoder so the canvas is never held twice in memory
+        palette = [(0, 0, 0, 0)] + [(*layer.display_color, 255) for layer in layers]
+        with open(f"{OUTPUT_NAME}.png", 'wb') as f:
+            png.Writer(master_w, master_h, palette=palette, bitdepth=8).write(f, master_owner_id)
+    else:
+        out = Image.fromarray(np.asarray(master_owner_id))
+        out.putpalette([0, 0, 0] + [c for layer in layers for c in layer.display_color])
+        out.save(f"{OUTPUT_NAME}.png", transparency=0)
 
     create_legend_image(layers)
 
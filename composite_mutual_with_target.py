@@ -182,7 +182,7 @@ def create_composite_map():
         try:
             with Image.open(layer.png_path) as img:
                 img = img.convert('RGB')
-                src_arr = np.array(img)
+                src_arr = np.asarray(img)
                 src_h, src_w, _ = src_arr.shape
 
                 y_start = int((global_north - layer.north) * ppd_lat)
@@ -195,9 +195,14 @@ def create_composite_map():
                 src_chunk = src_arr[:curr_h, :curr_w]
                 temp_loss = np.full((curr_h, curr_w), UNDEFINED_PATH_LOSS, dtype=np.float32)
                 
+                # Pad to RGBX and view each pixel as one uint32, so each color
+                # test is a single compare instead of three compares and two ANDs
+                src_rgbx = np.zeros((curr_h, curr_w, 4), dtype=np.uint8)
+                src_rgbx[..., :3] = src_chunk
+                src_u32 = src_rgbx.view(np.uint32)[..., 0]
                 for (r,g,b), db in color_scale.color_map.items():
-                    mask = (src_chunk[:,:,0]==r) & (src_chunk[:,:,1]==g) & (src_chunk[:,:,2]==b)
-                    temp_loss[mask] = db
+                    key = np.array([r, g, b, 0], dtype=np.uint8).view(np.uint32)[0]
+                    temp_loss[src_u32 == key] = db
 
                 # --- SORT INTO BUFFERS ---
                 if layer.is_target:
@@ -228,16 +233,17 @@ def create_composite_map():
 
     # --- PAINT OUTPUT ---
     print("Painting output...")
-    final_rgba = np.zeros((master_h, master_w, 4), dtype=np.uint8)
-
-    for db, r, g, b in color_scale.entries:
-        # Match pixels where limiting_loss == db
-        mask = (limiting_loss == db) & valid_mask
-        
-        final_rgba[mask, 0] = r
-        final_rgba[mask, 1] = g
-        final_rgba[mask, 2] = b
-        final_rgba[mask, 3] = 255
+    # One palette gather instead of a full-image mask per legend entry.
+    # Row 0 is a -inf sentinel painted FULLY TRANSPARENT.
+    entry_db = np.array([-np.inf] + [db for db, _, _, _ in color_scale.entries], dtype=np.float32)
+    palette_table = np.zeros((len(entry_db), 4), dtype=np.uint8)
+    for i, (db, r, g, b) in enumerate(color_scale.entries, start=1):
+        palette_table[i] = (r, g, b, 255)
+
+    # Last entry with db <= limiting_loss; kept only on an exact match
+    entry_idx = np.searchsorted(entry_db, limiting_loss, side='right') - 1
+    entry_idx[~valid_mask | (entry_db[entry_idx] != limiting_loss)] = 0
+    final_rgba = palette_table[entry_idx]
 
     Image.fromarray(final_rgba, 'RGBA').save(f"{OUTPUT_NAME}.png")
     create_legend_image(color_scale)
@@ -1,10 +1,34 @@
 import os
+import sys
+import atexit
+import tempfile
+import functools
+import hashlib
 import glob
-import re
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba is optional; without it the merge falls back to plain NumPy.
+    njit = None
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # pyvips is optional (it also needs the libvips library); without it maps are decoded with Pillow.
+    pyvips = None
+
+try:
+    import png
+except ImportError:
+    # pypng is optional; without it the output PNG is encoded by Pillow in memory.
+    png = None
+
 # --- FIX FOR LARGE MAPS ---
 Image.MAX_IMAGE_PIXELS = None
 
@@ -15,12 +39,53 @@ OUTPUT_NAME = 'composite_overlap'  # Changed output name
 LEGEND_FILENAME = 'composite_legend.png'
 
 # SIGNAL THRESHOLDS
-UNDEFINED_PATH_LOSS = 9999.0 
 VALID_THRESHOLD_DB = 150.0     # Signal must be this good (lower is better) to count as a "vote"
 MIN_OVERLAP_COUNT = 2          # Pixel is kept only if this many maps have valid signal
 
+# Path loss is stored as uint16 in 0.1 dB steps (0-6553.4 dB), half the memory
+# traffic of float32. 0xFFFF marks pixels with no defined path loss.
+LOSS_SCALE = 10
+UNDEFINED_PATH_LOSS = 0xFFFF
+VALID_THRESHOLD = int(round(VALID_THRESHOLD_DB * LOSS_SCALE))
+
+# NumPy merge: each layer is split into stripes of this many rows, merged on
+# MERGE_THREADS threads. Stripes never share rows, so they need no locking.
+# Each stripe is then checked in blocks of MERGE_BLOCK_COLS columns, and
+# blocks where the layer cannot improve any pixel are skipped.
+MERGE_BLOCK_ROWS = 256
+MERGE_BLOCK_COLS = 256
+MERGE_THREADS = os.cpu_count() or 1
+
+# Background I/O: KML files are parsed and the next PREFETCH_LAYERS maps are
+# decoded on threads while the current map is merged
+PREFETCH_LAYERS = 2
+
+# Canvases larger than this many pixels keep their buffers in memory-mapped
+# scratch files (7 bytes per pixel) instead of RAM
+MEMMAP_MIN_PIXELS = 100_000_000
+
+# Keep the 32 MB color lookup table as color_scale.lut-<key>.npy next to the LCF,
+# where <key> is a hash of the parsed colors and VALID_THRESHOLD. Later runs
+# memory-map it, which only reads the pages holding scale colors.
+CACHE_LUT = True
+
+# LCF fields are separated by ':', ',' or ';'. Map them all to ',' for a plain split
+LCF_SEPARATORS = str.maketrans(';:', ',,')
+
+# Byte positions of R, G and B within a native uint32 that reads as (R<<16)|(G<<8)|B
+RGB_KEY_BYTES = (2, 1, 0) if sys.byteorder == 'little' else (1, 2, 3)
+
+def pack_rgb(rgb):
+    # Copy the channels straight into the bytes of the uint32 keys instead of
+    # widening each one to uint32 and shifting/OR-ing them together
+    keys = np.zeros(rgb.shape[:-1] + (4,), dtype=np.uint8)
+    for c, byte in enumerate(RGB_KEY_BYTES):
+        keys[..., byte] = rgb[..., c]
+    return keys.view(np.uint32)[..., 0]
+
 class ColorScale:
     def __init__(self, lcf_path):
+        self.path = lcf_path
         self.color_map = {}
         self.entries = []
         self.load_lcf(lcf_path)
@@ -33,7 +98,7 @@ class ColorScale:
             for line in f:
                 line = line.strip()
                 if not line or line.startswith('#'): continue
-                parts = re.split(r'[;:,]\s*', line)
+                parts = [p.strip() for p in line.translate(LCF_SEPARATORS).split(',')]
                 if len(parts) >= 4:
                     try:
                         db = float(parts[0])
@@ -45,6 +110,77 @@ class ColorScale:
         self.entries.sort(key=lambda x: x[0])
         print(f"Loaded {len(self.color_map)} colors for legend.")
 
+    def build_lookup(self):
+        # Dense 24-bit LUT indexed by packed (R<<16)|(G<<8)|B, so a whole image
+        # is decoded with a single gather instead of one scan per color.
+        # Colors weaker than VALID_THRESHOLD_DB never count in this map, so they
+        # decode straight to UNDEFINED_PATH_LOSS and validity comes with the loss.
+        lut = np.full(1 << 24, UNDEFINED_PATH_LOSS, dtype=np.uint16)
+        for (r, g, b), db in self.color_map.items():
+            loss = min(max(round(db * LOSS_SCALE), 0), UNDEFINED_PATH_LOSS - 1)
+            if loss <= VALID_THRESHOLD:
+                lut[(r << 16) | (g << 8) | b] = loss
+        return lut
+
+    @functools.cached_property
+    def lut(self):
+        if not CACHE_LUT:
+            return self.build_lookup()
+        # The file name is keyed on what the table is built from, not on file
+        # times, so a different LCF (even one with an older mtime) never
+        # picks up another scale's table.
+        source = repr((VALID_THRESHOLD, LOSS_SCALE, sorted(self.color_map.items())))
+        cache_base = os.path.splitext(self.path)[0] + '.lut'
+        cache_path = f'{cache_base}-{hashlib.sha1(source.encode()).hexdigest()[:16]}.npy'
+        try:
+            return np.load(cache_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+
+        lut = self.build_lookup()
+        # Write then rename so an interrupted run never leaves a partial cache
+        tmp_path = cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, lut)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not write {cache_path}: {e}")
+            return lut
+        # Tables for other scales or thresholds are stale now
+        for old_path in glob.glob(glob.escape(cache_base) + '*.npy'):
+            if old_path != cache_path: remove_scratch_file(old_path)
+        return lut
+
+    def decode_loss(self, rgb):
+        return self.lut[pack_rgb(rgb)]
+
+# Fused per-layer merge: LUT decode, coverage count and best-signal update
+# in a single pass over the layer instead of one pass per NumPy operation.
+if njit is not None:
+    @njit(parallel=True, cache=True, nogil=True)
+    def merge_layer(src_chunk, lut, loss_slice, rgba_slice, count_slice, threshold):
+        h, w = loss_slice.shape
+        for i in prange(h):
+            for j in range(w):
+                r = src_chunk[i, j, 0]
+                g = src_chunk[i, j, 1]
+                b = src_chunk[i, j, 2]
+                loss = lut[(np.int64(r) << 16) | (np.int64(g) << 8) | np.int64(b)]
+                if loss <= threshold:
+                    if count_slice[i, j] < 255:
+                        count_slice[i, j] += 1
+                    if loss < loss_slice[i, j]:
+                        loss_slice[i, j] = loss
+                        rgba_slice[i, j, 0] = r
+                        rgba_slice[i, j, 1] = g
+                        rgba_slice[i, j, 2] = b
+                        rgba_slice[i, j, 3] = 255
+else:
+    merge_layer = None
+
+BBOX_FIELDS = ('north', 'south', 'east', 'west')
+
 class MapLayer:
     def __init__(self, kml_path):
         self.kml_path = kml_path
@@ -63,20 +199,143 @@ class MapLayer:
 
     def parse_kml(self):
         try:
-            tree = ET.parse(self.kml_path)
-            root = tree.getroot()
-            for elem in tree.iter():
-                if '}' in elem.tag:
-                    elem.tag = elem.tag.split('}', 1)[1]
-            bbox = root.find('.//LatLonBox')
+            # Stream the KML and stop at the first <LatLonBox> rather than
+            # building the whole tree. Tag names are qualified once with every
+            # namespace the document declares, default or prefixed (KML 2.1
+            # and 2.2 use different ones), so each element is matched with a
+            # plain lookup.
+            box_tags = {'LatLonBox'}
+            field_tags = {f: f for f in BBOX_FIELDS}
+            bbox = None
+            for event, item in ET.iterparse(self.kml_path, events=('start-ns', 'end')):
+                if event == 'start-ns':
+                    _, uri = item
+                    box_tags.add(f'{{{uri}}}LatLonBox')
+                    field_tags.update({f'{{{uri}}}{f}': f for f in BBOX_FIELDS})
+                    continue
+                if item.tag in box_tags:
+                    bbox = {field_tags[child.tag]: child.text for child in item if child.tag in field_tags}
+                    break
+                if item.tag not in field_tags:
+                    item.clear()
             if bbox is None: raise ValueError("No <LatLonBox>")
-            self.north = float(bbox.findtext('north'))
-            self.south = float(bbox.findtext('south'))
-            self.east = float(bbox.findtext('east'))
-            self.west = float(bbox.findtext('west'))
+            self.north = float(bbox.get('north'))
+            self.south = float(bbox.get('south'))
+            self.east = float(bbox.get('east'))
+            self.west = float(bbox.get('west'))
         except Exception as e:
             raise ValueError(f"XML Error {self.kml_path}: {e}")
 
+def remove_scratch_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def new_canvas(shape, dtype, fill=0):
+    if shape[0] * shape[1] <= MEMMAP_MIN_PIXELS:
+        return np.full(shape, fill, dtype=dtype)
+    # The system temp dir is often RAM-backed, so the scratch file goes next to the maps
+    fd, path = tempfile.mkstemp(prefix='.composite_', suffix='.dat', dir=INPUT_FOLDER)
+    os.close(fd)
+    canvas = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+    # On POSIX the open mapping outlives its directory entry, so the file is
+    # unlinked at once and nothing is left behind even if the process is
+    # killed. Windows refuses to delete a mapped file; there it goes at exit.
+    try:
+        os.remove(path)
+    except OSError:
+        atexit.register(remove_scratch_file, path)
+    if fill: canvas.fill(fill)
+    return canvas
+
+def read_rgb(path):
+    # libvips decodes PNGs noticeably faster than Pillow and releases the GIL while doing it
+    if pyvips is not None:
+        vimg = pyvips.Image.new_from_file(path, access='sequential')
+        if vimg.format == 'uchar' and vimg.bands in (3, 4):
+            if vimg.bands == 4: vimg = vimg.extract_band(0, n=3)
+            return np.ndarray(buffer=vimg.write_to_memory(), dtype=np.uint8,
+                              shape=(vimg.height, vimg.width, 3))
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGB'))
+
+def merge_rows(color_scale, src_rows, loss_rows, rgba_rows, count_rows):
+    # Merges one row stripe of a layer into the matching canvas views.
+    # NumPy releases the GIL here, so stripes run in parallel.
+
+    # Convert Colors to dB
+    temp_loss = color_scale.decode_loss(src_rows)
+
+    # --- NEW OVERLAP LOGIC ---
+    
+    # 1. Identify Valid Signal pixels (Must be <= 150 dB, the LUT already
+    # sent everything weaker to UNDEFINED_PATH_LOSS)
+    valid_signal_mask = temp_loss != UNDEFINED_PATH_LOSS
+    
+    # 2. Update Count Buffer
+    # We simply add +1 to the coverage count for every valid pixel in this map.
+    # Adding the 0/1 mask is a dense in-place update with no scatter, and pixels
+    # that already reached 255 are left alone instead of wrapping to 0
+    count_rows += valid_signal_mask.view(np.uint8) & (count_rows != 255)
+
+    # 3. Update Visuals (Standard "Best Signal" Logic)
+    # We still track the "best" signal in the background. 
+    # We will filter out the "lonely" pixels later.
+    for x0 in range(0, temp_loss.shape[1], MERGE_BLOCK_COLS):
+        cols = slice(x0, x0 + MERGE_BLOCK_COLS)
+        loss_block = temp_loss[:, cols]
+        master_block = loss_rows[:, cols]
+
+        # Nothing can improve if even the best new pixel is no lower than the
+        # highest current value, e.g. a weak distant site under a strong one
+        if loss_block.min() >= master_block.max(): continue
+
+        # Update if new signal is STRONGER (lower) AND VALID. Invalid pixels
+        # decode to UNDEFINED_PATH_LOSS, which is never lower than the master
+        # value, so a single compare covers both tests
+        better_signal_mask = loss_block < master_block
+
+        # Index assignment into the views: no np.where temporaries and no
+        # write-back of the whole region. The mask is turned into indices once
+        # and reused for all four reads and writes below.
+        better = np.nonzero(better_signal_mask)
+        master_block[better] = loss_block[better]
+        
+        # master_rgba starts fully transparent, so only updated pixels get alpha
+        rgba_block = rgba_rows[:, cols]
+        rgba_block[better + (slice(0, 3),)] = src_rows[:, cols][better]
+        rgba_block[better + (3,)] = 255
+
+def prefetch_layers(pool, layers):
+    # Yields (layer, future) in layer order while keeping at most
+    # PREFETCH_LAYERS maps decoding ahead, which bounds the memory they hold.
+    pending = deque()
+    for layer in layers:
+        pending.append((layer, pool.submit(read_rgb, layer.png_path)))
+        if len(pending) > PREFETCH_LAYERS:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+def save_composite_png(master_rgba, path):
+    master_h, master_w, _ = master_rgba.shape
+    if png is not None:
+        # Stream rows to the encoder so the canvas is never held twice in memory
+        with open(path, 'wb') as f:
+            png.Writer(master_w, master_h, greyscale=False, alpha=True, bitdepth=8).write(
+                f, (row.reshape(-1) for row in master_rgba))
+        return
+
+    if isinstance(master_rgba, np.memmap):
+        # Copy the canvas over a stripe at a time so the mapped pages can be dropped as we go
+        out = Image.new('RGBA', (master_w, master_h))
+        for y0 in range(0, master_h, MERGE_BLOCK_ROWS):
+            out.paste(Image.fromarray(np.asarray(master_rgba[y0:y0 + MERGE_BLOCK_ROWS]), 'RGBA'), (0, y0))
+    else:
+        out = Image.fromarray(master_rgba, 'RGBA')
+    out.save(path)
+
 def create_legend_image(color_scale):
     print("Generating legend image...")
     entry_height = 30       
@@ -103,26 +362,27 @@ def create_legend_image(color_scale):
     total_width = int(left_margin + max_text_width + padding + box_width)
     total_height = (len(color_scale.entries) * entry_height) + (padding * 2)
 
-    img = Image.new('RGBA', (total_width, total_height), (0, 0, 0, 0))
+    # Color boxes (with their 1px black outline) are painted as NumPy row
+    # bands in one array; Pillow is only used for the text.
+    legend_arr = np.zeros((total_height, total_width, 4), dtype=np.uint8)
+    boxes = legend_arr[:, total_width - box_width:]
+    for i, (_, r, g, b) in enumerate(color_scale.entries):
+        y0 = padding + i * entry_height
+        boxes[y0:y0 + box_height + 1] = (r, g, b, 255)
+        boxes[[y0, y0 + box_height]] = (0, 0, 0, 255)
+        boxes[y0:y0 + box_height + 1, 0] = (0, 0, 0, 255)
+    img = Image.fromarray(legend_arr)
     draw = ImageDraw.Draw(img)
 
     current_y = padding
-    for db, r, g, b in color_scale.entries:
+    for db, _, _, _ in color_scale.entries:
         label = f"{db:.0f} dB"
         text_bbox = draw.textbbox((0, 0), label, font=font)
         text_w = text_bbox[2] - text_bbox[0]
         text_x = total_width - box_width - padding - text_w
         
-        for ox in [-1, 1]:
-            for oy in [-1, 1]:
-                draw.text((text_x + ox, current_y + oy), label, font=font, fill=(0,0,0,255))
-        
-        draw.text((text_x, current_y), label, fill=(255, 255, 255, 255), font=font)
-        draw.rectangle(
-            [total_width - box_width, current_y, total_width, current_y + box_height],
-            fill=(r, g, b, 255),
-            outline=(0, 0, 0, 255)
-        )
+        draw.text((text_x, current_y), label, fill=(255, 255, 255, 255), font=font,
+                  stroke_width=1, stroke_fill=(0, 0, 0, 255))
         current_y += entry_height
 
     img.save(LEGEND_FILENAME)
@@ -136,50 +396,54 @@ def create_composite_map():
         print(f"Error: {e}")
         return
 
-    kml_files = glob.glob(os.path.join(INPUT_FOLDER, '*.kml'))
-    layers = []
-    
-    print("Parsing KML files...")
-    for kml in kml_files:
-        if OUTPUT_NAME in kml: continue 
-        try:
-            layer = MapLayer(kml)
-            layers.append(layer)
-            print(f" - Found: {os.path.basename(kml)}")
-        except Exception: pass
-
-    if not layers: return
-
-    global_north = max(l.north for l in layers)
-    global_south = min(l.south for l in layers)
-    global_east = max(l.east for l in layers)
-    global_west = min(l.west for l in layers)
-
-    ref_layer = layers[0]
-    with Image.open(ref_layer.png_path) as img:
-        w, h = img.size
-        ppd_lat = h / (ref_layer.north - ref_layer.south)
-        ppd_lon = w / (ref_layer.east - ref_layer.west)
-
-    master_h = int((global_north - global_south) * ppd_lat)
-    master_w = int((global_east - global_west) * ppd_lon)
-
-    print(f"Canvas: {master_w}x{master_h} pixels")
-    
-    # BUFFERS
-    # 1. Best Signal found so far
-    master_loss = np.full((master_h, master_w), UNDEFINED_PATH_LOSS, dtype=np.float32)
-    # 2. Visual representation of that best signal
-    master_rgba = np.zeros((master_h, master_w, 4), dtype=np.uint8)
-    # 3. OVERLAP COUNTER: How many maps have valid signal at this pixel?
-    coverage_count = np.zeros((master_h, master_w), dtype=np.uint8)
+    with ThreadPoolExecutor(max_workers=PREFETCH_LAYERS) as io_pool, \
+         ThreadPoolExecutor(max_workers=MERGE_THREADS) as pool:
+        # Load (or build) the color lookup table while the KML files are parsed
+        lut_ready = io_pool.submit(getattr, color_scale, 'lut')
 
-    for layer in layers:
-        print(f"Merging {os.path.basename(layer.png_path)}...")
-        try:
-            with Image.open(layer.png_path) as img:
-                img = img.convert('RGB')
-                src_arr = np.array(img)
+        kml_files = glob.glob(os.path.join(INPUT_FOLDER, '*.kml'))
+        parsed = [(kml, io_pool.submit(MapLayer, kml)) for kml in kml_files if OUTPUT_NAME not in kml]
+        layers = []
+        
+        print("Parsing KML files...")
+        for kml, future in parsed:
+            try:
+                layer = future.result()
+                layers.append(layer)
+                print(f" - Found: {os.path.basename(kml)}")
+            except Exception: pass
+
+        lut_ready.result()
+        if not layers: return
+
+        global_north = max(l.north for l in layers)
+        global_south = min(l.south for l in layers)
+        global_east = max(l.east for l in layers)
+        global_west = min(l.west for l in layers)
+
+        ref_layer = layers[0]
+        with Image.open(ref_layer.png_path) as img:
+            w, h = img.size
+            ppd_lat = h / (ref_layer.north - ref_layer.south)
+            ppd_lon = w / (ref_layer.east - ref_layer.west)
+
+        master_h = int((global_north - global_south) * ppd_lat)
+        master_w = int((global_east - global_west) * ppd_lon)
+
+        print(f"Canvas: {master_w}x{master_h} pixels")
+        
+        # BUFFERS
+        # 1. Best Signal found so far
+        master_loss = new_canvas((master_h, master_w), np.uint16, UNDEFINED_PATH_LOSS)
+        # 2. Visual representation of that best signal
+        master_rgba = new_canvas((master_h, master_w, 4), np.uint8)
+        # 3. OVERLAP COUNTER: How many maps have valid signal at this pixel?
+        coverage_count = new_canvas((master_h, master_w), np.uint8)
+
+        for layer, decoded in prefetch_layers(io_pool, layers):
+            print(f"Merging {os.path.basename(layer.png_path)}...")
+            try:
+                src_arr = decoded.result()
                 src_h, src_w, _ = src_arr.shape
 
                 y_start = int((global_north - layer.north) * ppd_lat)
@@ -190,54 +454,38 @@ def create_composite_map():
                 if curr_h <= 0 or curr_w <= 0: continue
 
                 src_chunk = src_arr[:curr_h, :curr_w]
-                temp_loss = np.full((curr_h, curr_w), UNDEFINED_PATH_LOSS, dtype=np.float32)
-                
-                # Convert Colors to dB
-                for (r,g,b), db in color_scale.color_map.items():
-                    mask = (src_chunk[:,:,0]==r) & (src_chunk[:,:,1]==g) & (src_chunk[:,:,2]==b)
-                    temp_loss[mask] = db
-
-                # --- NEW OVERLAP LOGIC ---
-                
-                # 1. Identify Valid Signal pixels (Must be <= 150 dB)
-                valid_signal_mask = temp_loss <= VALID_THRESHOLD_DB
-                
-                # 2. Update Count Buffer
-                # We simply add +1 to the coverage count for every valid pixel in this map
-                coverage_count[y_start:y_end, x_start:x_end][valid_signal_mask] += 1
-
-                # 3. Update Visuals (Standard "Best Signal" Logic)
-                # We still track the "best" signal in the background. 
-                # We will filter out the "lonely" pixels later.
-                master_slice = master_loss[y_start:y_end, x_start:x_end]
-                
-                # Update if new signal is STRONGER (lower) AND VALID
-                better_signal_mask = (temp_loss < master_slice) & valid_signal_mask
-
-                master_loss[y_start:y_end, x_start:x_end] = np.where(better_signal_mask, temp_loss, master_slice)
-                
-                target_region = master_rgba[y_start:y_end, x_start:x_end]
-                src_chunk_rgba = np.zeros((curr_h, curr_w, 4), dtype=np.uint8)
-                src_chunk_rgba[..., :3] = src_chunk
-                src_chunk_rgba[..., 3] = 255
-                
-                target_region[better_signal_mask] = src_chunk_rgba[better_signal_mask]
-                master_rgba[y_start:y_end, x_start:x_end] = target_region
-
-        except Exception as e:
-            print(f"Error: {e}")
+                # Canvas views covered by this layer, sliced once and shared by all stripes
+                loss_view = master_loss[y_start:y_end, x_start:x_end]
+                rgba_view = master_rgba[y_start:y_end, x_start:x_end]
+                count_view = coverage_count[y_start:y_end, x_start:x_end]
+                if merge_layer is not None:
+                    merge_layer(src_chunk, color_scale.lut, loss_view, rgba_view, count_view, VALID_THRESHOLD)
+                    continue
+
+                stripes = []
+                for y0 in range(0, curr_h, MERGE_BLOCK_ROWS):
+                    rows = slice(y0, y0 + MERGE_BLOCK_ROWS)
+                    stripes.append(pool.submit(merge_rows, color_scale, src_chunk[rows],
+                                               loss_view[rows], rgba_view[rows], count_view[rows]))
+                for stripe in stripes:
+                    stripe.result()
+
+            except Exception as e:
+                print(f"Error: {e}")
 
     # --- FINAL FILTERING ---
     print(f"Applying overlap filter (Min {MIN_OVERLAP_COUNT} maps with signal <= {VALID_THRESHOLD_DB}dB)...")
     
-    # Identify pixels that do NOT meet the overlap requirement
-    insufficient_overlap_mask = coverage_count < MIN_OVERLAP_COUNT
-    
-    # Wipe them out (Set to transparent)
-    master_rgba[insufficient_overlap_mask] = (0, 0, 0, 0)
+    for y0 in range(0, master_h, MERGE_BLOCK_ROWS):
+        rows = slice(y0, y0 + MERGE_BLOCK_ROWS)
+        # Identify pixels that do NOT meet the overlap requirement
+        insufficient_overlap_mask = coverage_count[rows] < MIN_OVERLAP_COUNT
+        
+        # Wipe them out (Set to transparent)
+        master_rgba[rows][insufficient_overlap_mask] = (0, 0, 0, 0)
 
     print("Saving composite map...")
-    Image.fromarray(master_rgba, 'RGBA').save(f"{OUTPUT_NAME}.png")
+    save_composite_png(master_rgba, f"{OUTPUT_NAME}.png")
 
     create_legend_image(color_scale)
 